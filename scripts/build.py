@@ -22,18 +22,310 @@
 from __future__ import print_function
 
 
-def main():
-    """Main script function."""
+def compress(path, formats=("gz",)):
+    """Write precompressed siblings of a file for the given formats."""
+
+    import io
+    import gzip
+    import shutil
+
+    for fmt in formats:
+        outpath = "{0}.{1}".format(path, fmt)
+        with io.open(path, "rb") as fd1:
+            if fmt == "gz":
+                # Fix the timestamp so that builds are reproducible.
+                with io.open(outpath, "wb") as fd2:
+                    fd3 = gzip.GzipFile(filename="", mode="wb", fileobj=fd2,
+                                        compresslevel=9, mtime=0)
+                    try:
+                        shutil.copyfileobj(fd1, fd3)
+                    finally:
+                        fd3.close()
+            elif fmt == "xz":
+                import lzma
+                with lzma.open(outpath, "wb", preset=9) as fd2:
+                    shutil.copyfileobj(fd1, fd2)
+            else:
+                msg = "unsupported compression format '{0}'".format(fmt)
+                raise ValueError(msg)
+
+
+def compress_tree(root, formats=("gz",)):
+    """Write precompressed siblings of every script below a folder.
+
+    Return the total size in bytes of the precompressed files.
+    """
+
+    import os
+
+    nbytes = 0
+    for folder, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(folder, name)
+                compress(path, formats=formats)
+                nbytes += sum(os.path.getsize("{0}.{1}".format(path, fmt))
+                              for fmt in formats)
+    return nbytes
+
+
+def collect_timings(timings, path, record):
+    """Add the timing records of a `generate.py` run to a collector.
+
+    The records found in the JSON report at ``path`` are tagged with the
+    target label, and ``record`` (started before the run) is stopped and
+    kept as the `overhead` of the run (interpreter startup, imports and
+    reporting), so that the target total matches the run wall time.
+    """
+
+    import io
+    import os
+    import json
+
+    records = []
+    if os.path.isfile(path):
+        with io.open(path, "r", encoding="utf-8") as fd:
+            report = json.load(fd)
+        record["target"] = report["label"]
+        records = report["records"]
+    timings.stop(record)
+    for item in records:
+        item["target"] = record["target"]
+        record["seconds"] -= item["seconds"]
+        timings.records.append(item)
+    record["seconds"] = max(record["seconds"], 0.0)
+
+
+def verify(path):
+    """Load a generated script and check every bundled package payload.
+
+    Return a report with the script size, the time needed to parse the
+    script and to decode its payloads, and the size of every payload.
+    Raise a :class:`ValueError` if any payload does not match its hash.
+    """
 
     import io
     import os
     import re
+    import time
+    import base64
+    import hashlib
+
+    with io.open(path, "rb") as fd:
+        source = fd.read()
+
+    # Read the script header.
+    match = re.search(br"^__version__ = \"(.*)\"$", source, re.MULTILINE)
+    version = match.group(1).decode("utf-8") if match else None
+
+    # Parse the script and load its `PACKAGES` index.
+    start = time.time()
+    code = compile(source, path, "exec")
+    namespace = {"__name__": "__verify__"}
+    exec(code, namespace)  # pylint: disable=exec-used
+    packages = namespace["PACKAGES"]
+    parse_seconds = time.time() - start
+
+    # Decode the payloads and check their hashes.
+    report = {}
+    start = time.time()
+    for name, pkg in packages.items():
+        text = "".join(line.strip() for line in pkg["filedata"].split("\n"))
+        data = base64.b64decode(text)
+        if hashlib.sha256(data).hexdigest() != pkg["sha256"]:
+            msg = "hash mismatch for package {0} in {1}"
+            raise ValueError(msg.format(name, os.path.basename(path)))
+        report[name] = {
+            "filename": pkg["filename"],
+            "size": len(text),
+            "bytes": len(data),
+        }
+    decode_seconds = time.time() - start
+
+    return {
+        "version": version,
+        "size": len(source),
+        "parse_seconds": parse_seconds,
+        "decode_seconds": decode_seconds,
+        "packages": report,
+    }
+
+
+def generate(target, arch, abi, dest, source, timings=None):
+    """Call the `generate.py` script and return its exit code."""
+
+    import os
     import sys
-    import argparse
-    import itertools
     import subprocess
+
+    here = os.path.dirname(__file__)
+    return subprocess.call([
+        sys.executable, "-u",
+        os.path.join(here, "generate.py"),
+        "--target", target,
+        "--arch", arch,
+        "--abi", abi,
+        "--dest", dest,
+        "--source", source,
+    ] + (["--timings", timings] if timings else []))
+
+
+def build_scripts(args, timings):
+    """Build every version-specific script by calling `generate.py`.
+
+    Return the list of expected script paths and the list of failures
+    (non-zero exit codes and missing scripts).
+    """
+
+    import os
+    import re
+    import shutil
+    import tempfile
+    import itertools
+    from generate import get_label
+
+    targets = ("Linux", "Windows")
+    archs = ("32bit", "64bit")
+    abis = ("cp26m", "cp26mu", "cp27m", "cp27mu")
+    paths = []
+    failures = []
+    tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-pyopenssl-timings-")
+
+    try:
+        for target, arch, abi in itertools.product(targets, archs, abis):
+
+            # Do not build 'mu' ABI for Windows.
+            if target == "Windows" and abi.endswith("u"):
+                continue
+
+            # Get Python version from ABI.
+            version = re.match(r"cp(\d+)m?u?", abi).groups(1)[0]
+            version = ".".join([version[0], version[1:]])
+            label = get_label(target, arch, abi)
+            dest = os.path.join(args.dest, "pip", version)
+            path = os.path.join(dest, "get-pip-pyopenssl-{0}.py".format(label))
+            paths.append(path)
+
+            # Call the generate script (removing any stale script first).
+            print("- Building {0} for {1} {2}...".format(abi, target, arch))
+            if os.path.isfile(path):
+                os.remove(path)
+            tmppath = os.path.join(tmpdir, "{0}.json".format(label))
+            record = timings.start("overhead", target=label)
+            retcode = generate(target, arch, abi, dest, args.source,
+                               tmppath if args.timings else None)
+            if retcode != 0:
+                failures.append("{0}: generate.py failed with exit code {1}"
+                                .format(label, retcode))
+            elif not os.path.isfile(path):
+                failures.append("{0}: missing script {1}".format(label, path))
+
+            # Collect the timing records of the target.
+            if args.timings:
+                collect_timings(timings, tmppath, record)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return paths, failures
+
+
+def build_helper(dest, remote=None):
+    """Write out the helper script and return its size in bytes."""
+
+    import io
+    import os
     from generate import __version__
 
+    here = os.path.dirname(__file__)
+    template = os.path.join(here, "template-main.py")
+    outfile = os.path.join(dest, "get-pip-pyopenssl.py")
+    with io.open(outfile, "wb") as fd1:
+        with io.open(template, "r", encoding="utf-8") as fd2:
+            for line2 in fd2:
+                if line2 == "__version__ = None\n":
+                    line2 = "__version__ = \"{0}\"\n".format(__version__)
+                if line2.startswith("    scriptroot =") and remote:
+                    line2 = "    scriptroot = \"{0}\"\n".format(remote)
+                fd1.write(line2.encode("utf-8"))
+    return os.path.getsize(outfile)
+
+
+def check_budgets(name, report, args, baseline=None):
+    """Return the list of budget failures of a script verification report.
+
+    The size and time of the script are checked against the absolute
+    budgets, and its size against the ``baseline`` report entry (if any)
+    using the allowed regression in percent.
+    """
+
+    failures = []
+    seconds = report["parse_seconds"] + report["decode_seconds"]
+    if args.max_size is not None and report["size"] > args.max_size:
+        failures.append("{0}: size {1} exceeds budget {2}".format(
+            name, report["size"], args.max_size))
+    if args.max_time is not None and seconds > args.max_time:
+        failures.append("{0}: time {1:.2f} s exceeds budget {2} s".format(
+            name, seconds, args.max_time))
+    if baseline is not None:
+        limit = baseline["size"] * (1 + args.max_regression / 100)
+        if report["size"] > limit:
+            failures.append("{0}: size {1} regressed more than {2}% from {3}"
+                            .format(name, report["size"],
+                                    args.max_regression, baseline["size"]))
+    return failures
+
+
+def verify_all(paths, args):
+    """Verify the generated scripts and check them against the budgets.
+
+    Return the verification reports (by script name) and the list of
+    failures. Missing scripts are skipped (they are reported when built),
+    but baseline entries without a current script are failures.
+    """
+
+    import io
+    import os
+    import json
+
+    baseline = {}
+    if args.baseline:
+        with io.open(args.baseline, "r", encoding="utf-8") as fd:
+            baseline = json.load(fd)["scripts"]
+
+    reports = {}
+    failures = []
+    for path in paths:
+        name = os.path.basename(path)
+        if not os.path.isfile(path):
+            continue
+        try:
+            report = verify(path)
+        except (ValueError, SyntaxError, KeyError) as err:
+            failures.append("{0}: {1}".format(name, err))
+            continue
+        reports[name] = report
+        print("- Verified {0}: {1} bytes, {2:.2f} s".format(
+            name, report["size"],
+            report["parse_seconds"] + report["decode_seconds"]))
+        failures.extend(check_budgets(name, report, args, baseline.get(name)))
+
+    names = set(os.path.basename(path) for path in paths)
+    for name in sorted(baseline):
+        if name not in names or name not in reports:
+            failures.append("{0}: in baseline but not built".format(name))
+    return reports, failures
+
+
+def main():
+    """Main script function."""
+
+    import io
+    import sys
+    import json
+    import argparse
+    from generate import __version__
+    from generate import Timings
+
     # Define arguments.
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -44,47 +336,74 @@ def main():
         "--remote",
         type=str, help="Expected remote root location", required=False,
         default=None)
+    parser.add_argument(
+        "--xz",
+        action="store_true", help="Emit also '.xz' compressed artifacts",
+        required=False, default=False)
+    parser.add_argument(
+        "--timings",
+        type=str, help="JSON file where to write the timing report",
+        required=False, default=None)
+    parser.add_argument(
+        "--source",
+        type=str, help="Package source ('pypi', simple index url or folder)",
+        required=False, default="pypi")
+    parser.add_argument(
+        "--verify-report",
+        type=str, help="JSON file where to write the verification report",
+        required=False, default=None)
+    parser.add_argument(
+        "--baseline",
+        type=str, help="Verification report of a previous build",
+        required=False, default=None)
+    parser.add_argument(
+        "--max-size",
+        type=int, help="Size budget in bytes of every generated script",
+        required=False, default=None)
+    parser.add_argument(
+        "--max-time",
+        type=float, help="Parse and decode time budget in seconds of every "
+                         "generated script",
+        required=False, default=None)
+    parser.add_argument(
+        "--max-regression",
+        type=float, help="Allowed script size growth in percent with "
+                         "respect to the baseline report",
+        required=False, default=10.0)
 
     # Parse arguments.
     args = parser.parse_args()
+    timings = Timings()
 
-    here = os.path.dirname(__file__)
-    targets = ("Linux", "Windows")
-    archs = ("32bit", "64bit")
-    abis = ("cp26m", "cp26mu", "cp27m", "cp27mu")
+    # Build the version-specific scripts and the helper script.
+    paths, failures = build_scripts(args, timings)
+    record = timings.start("render", target="build")
+    timings.stop(record, build_helper(args.dest, args.remote))
 
-    for target, arch, abi in itertools.product(targets, archs, abis):
+    # Verify the generated scripts against the budgets.
+    record = timings.start("verify", target="build")
+    reports, errors = verify_all(paths, args)
+    failures.extend(errors)
+    timings.stop(record, sum(item["size"] for item in reports.values()))
+    if args.verify_report:
+        with io.open(args.verify_report, "wb") as fd:
+            content = {"version": __version__, "scripts": reports}
+            fd.write(json.dumps(content, indent=2, sort_keys=True)
+                     .encode("utf-8"))
 
-        # Do not build 'mu' ABI for Windows.
-        if target == "Windows" and abi.endswith("u"):
-            continue
+    # Write out the precompressed artifacts.
+    record = timings.start("compress", target="build")
+    timings.stop(record, compress_tree(
+        args.dest, formats=("gz", "xz") if args.xz else ("gz",)))
 
-        # Get Python version from ABI.
-        version = re.match(r"cp(\d+)m?u?", abi).groups(1)[0]
-        version = ".".join([version[0], version[1:]])
-
-        # Call the generate script.
-        print("- Building {0} for {1} {2}...".format(abi, target, arch))
-        subprocess.call([
-            sys.executable, "-u",
-            os.path.join(here, "generate.py"),
-            "--target", target,
-            "--arch", arch,
-            "--abi", abi,
-            "--dest", os.path.join(args.dest, "pip", version),
-        ])
-
-    # Write out the helper script.
-    template = os.path.join(here, "template-main.py")
-    outfile = os.path.join(args.dest, "get-pip-pyopenssl.py")
-    with io.open(outfile, "wb") as fd1:
-        with io.open(template, "r", encoding="utf-8") as fd2:
-            for line2 in fd2:
-                if line2 == "__version__ = None\n":
-                    line2 = "__version__ = \"{0}\"\n".format(__version__)
-                if line2.startswith("    scriptroot =") and args.remote:
-                    line2 = "    scriptroot = \"{0}\"\n".format(args.remote)
-                fd1.write(line2.encode("utf-8"))
+    # Write out the timing report.
+    if args.timings:
+        timings.dump(args.timings, targets=sorted(timings.totals("target")))
+        print(timings.summary())
+
+    # Fail if any script could not be built, is broken or exceeds budgets.
+    if failures:
+        sys.exit("\n".join(["Build failed:"] + failures))
 
 
 if __name__ == "__main__":
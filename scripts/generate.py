@@ -33,9 +33,40 @@ that left `pip` unusable for the Python versions without SNI support:
     https://github.com/pypa/pypi-support/issues/974
     https://github.com/pypa/pypi-support/issues/978
 """
+from __future__ import print_function
 
 __version__ = "0.4.0+dev"
 
+# Platform tags of the supported targets and architectures.
+PLATFORMS = {
+    ("Windows", "32bit"):
+        "win32",
+    ("Windows", "64bit"):
+        "win_amd64",
+    ("Linux", "32bit"):
+        "manylinux1_i686",
+    ("Linux", "64bit"):
+        "manylinux1_x86_64",
+}
+
+# Wheel members that are never needed at runtime, whatever the package.
+SLIM_EXCLUDE = (
+    "*/tests/*",
+    "*/__pycache__/*",
+    "*.pyc",
+    "*.pyo",
+)
+
+# Wheel members that are only needed at runtime on specific targets.
+SLIM_EXCLUDE_TARGET = {
+    "Linux": (
+        # Script launchers bundled by `pip` (`distlib`) and `setuptools`.
+        "*.exe",
+    ),
+    "Windows": (
+    ),
+}
+
 
 def makedirs(name, mode=511, exist_ok=False):
     """Create a leaf directory and all intermediate ones.
@@ -58,6 +89,15 @@ def makedirs(name, mode=511, exist_ok=False):
         raise
 
 
+def get_label(target, arch, abi):
+    """Return the label of the script for a target, architecture and ABI."""
+
+    import re
+
+    version = re.match(r"(cp\d+)m?u?", abi).groups(1)[0]
+    return "-".join([version, abi, PLATFORMS[(target, arch)]])
+
+
 class cachedproperty(property):  # pylint: disable=invalid-name
     """Property that caches its value after first calculation."""
 
@@ -87,125 +127,631 @@ class cachedproperty(property):  # pylint: disable=invalid-name
             return cache[self.name]
 
 
-class Package(object):
-    """Wrapper class for Python packages coming from PyPI."""
+class Timings(object):
+    """Collector of elapsed times and sizes of the build phases."""
+
+    def __init__(self, records=None):
+        """Create a new instance, optionally from existing records."""
+
+        self.records = list(records or [])
+
+    def start(self, phase, package=None, target=None):
+        """Start timing a build phase and return its record."""
+
+        import time
+
+        return {
+            "phase": phase,
+            "package": package,
+            "target": target,
+            "start": time.time(),
+        }
+
+    def stop(self, record, nbytes=None):
+        """Stop timing a build phase and store its record."""
+
+        import time
+
+        record["seconds"] = time.time() - record.pop("start")
+        record["bytes"] = nbytes
+        self.records.append(record)
+        return record
+
+    def totals(self, key="phase"):
+        """Return the accumulated seconds and bytes grouped by a key."""
+
+        totals = {}
+        for record in self.records:
+            item = totals.setdefault(record[key], {"seconds": 0.0, "bytes": 0})
+            item["seconds"] += record["seconds"]
+            item["bytes"] += record["bytes"] or 0
+        return totals
+
+    def critical(self):
+        """Return the critical path as a dictionary.
+
+        The critical path is given by the slowest target (the whole run
+        for a single target), its dominant phase and the slowest record
+        of that phase. Return None if there are no records.
+        """
+
+        if not self.records:
+            return None
+
+        targets = self.totals("target")
+        target = max(targets, key=lambda name: targets[name]["seconds"])
+        inner = Timings([record for record in self.records
+                         if record["target"] == target])
+        phases = inner.totals("phase")
+        phase = max(phases, key=lambda name: phases[name]["seconds"])
+        slowest = max((record for record in inner.records
+                       if record["phase"] == phase),
+                      key=lambda record: record["seconds"])
+        return {
+            "target": target,
+            "target_seconds": targets[target]["seconds"],
+            "phase": phase,
+            "phase_seconds": phases[phase]["seconds"],
+            "package": slowest["package"],
+            "package_seconds": slowest["seconds"],
+        }
+
+    def dump(self, path, **extra):
+        """Write the timing records and totals into a JSON file."""
+
+        import io
+        import json
+
+        content = dict(extra)
+        content["records"] = self.records
+        content["totals"] = self.totals()
+        with io.open(path, "wb") as fd:
+            fd.write(json.dumps(content, indent=2, sort_keys=True).encode("utf-8"))
+
+    def summary(self):
+        """Return a short human-readable report of the timing records."""
+
+        lines = []
+        total = sum(record["seconds"] for record in self.records)
+        groups = [("phase", "Phase")]
+        if any(record["target"] for record in self.records):
+            groups.append(("target", "Target"))
+        for key, title in groups:
+            lines.append("{0:<40} {1:>10} {2:>7} {3:>14}".format(
+                title, "seconds", "%", "bytes"))
+            totals = self.totals(key)
+            for name in sorted(totals, key=lambda name, totals=totals:
+                               -totals[name]["seconds"]):
+                item = totals[name]
+                lines.append("{0:<40} {1:>10.2f} {2:>6.1f}% {3:>14}".format(
+                    name, item["seconds"],
+                    100.0 * item["seconds"] / (total or 1), item["bytes"]))
+            lines.append("")
+
+        path = self.critical()
+        if path is not None:
+            steps = []
+            if path["target"] is not None:
+                steps.append("{0} ({1:.2f} s, {2:.1f}%)".format(
+                    path["target"], path["target_seconds"],
+                    100.0 * path["target_seconds"] / (total or 1)))
+            steps.append("{0} ({1:.2f} s)".format(
+                path["phase"], path["phase_seconds"]))
+            if path["package"] is not None:
+                steps.append("{0} ({1:.2f} s)".format(
+                    path["package"], path["package_seconds"]))
+            lines.append("* Critical path: {0}".format(" > ".join(steps)))
+        lines.append("* Total: {0:.2f} s".format(total))
+        return "\n".join(lines)
+
+
+class Source(object):
+    """Base class for the sources of Python packages."""
+
+    def __init__(self):
+        """Create a new instance with empty metadata caches."""
+
+        self.messages = {}
+        self.usage = {}
+
+    def account(self, package, nbytes):
+        """Add the size of a metadata document read for a package."""
+
+        self.usage[package.filename] = self.usage.get(package.filename, 0) + nbytes
+
+    def metadata_size(self, package):
+        """Return the size of the metadata documents read for a package."""
+
+        return self.usage.get(package.filename, 0)
+
+    def url(self, package):
+        """Return the location of a package in the source."""
+
+        raise NotImplementedError
+
+    def fetch(self, package):
+        """Return the content of a package as a :class:`bytes` object."""
 
-    def __init__(self, filename):
-        """Create a new instance from a Python package filename."""
+        try:
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import urlopen
 
-        self.filename = filename
-        self.data = None
+        conn = urlopen(self.url(package))
+        try:
+            return conn.read()
+        finally:
+            conn.close()
 
-    @property
-    def name(self):
-        """Python package name."""
+    def metadata(self, package):
+        """Return the core metadata of a package as a message object."""
+
+        import io
+        import tarfile
+        import zipfile
+        from email.parser import Parser
+
+        if package.filename in self.messages:
+            return self.messages[package.filename]
+        if package.data is None:
+            package.download()
+        stream = io.BytesIO(package.data)
+
+        content = None
+        if package.filename.endswith((".whl", ".zip")):
+            # Wheels keep it in `.dist-info`, zip sdists in the root folder.
+            suffix = ("/PKG-INFO" if package.filename.endswith(".zip")
+                      else ".dist-info/METADATA")
+            archive = zipfile.ZipFile(stream, "r")
+            try:
+                for member in archive.namelist():
+                    if member.count("/") == 1 and member.endswith(suffix):
+                        content = archive.read(member)
+                        break
+            finally:
+                archive.close()
+        else:
+            archive = tarfile.open(fileobj=stream, mode="r:*")
+            try:
+                for member in archive.getmembers():
+                    if (member.name.count("/") == 1 and
+                            member.name.endswith("/PKG-INFO")):
+                        content = archive.extractfile(member).read()
+                        break
+            finally:
+                archive.close()
+
+        if content is None:
+            msg = "no metadata found for package {0}".format(package.filename)
+            raise ValueError(msg)
+        self.account(package, len(content))
+        message = Parser().parsestr(content.decode("utf-8"))
+        self.messages[package.filename] = message
+        return message
+
+    def author(self, package):
+        """Return the package author from its core metadata."""
+
+        from email.utils import parseaddr
+
+        metadata = self.metadata(package)
+        author = metadata.get("Author", "").strip()
+        if not author or author == "UNKNOWN":
+            author = parseaddr(metadata.get("Author-email", ""))[0]
+        if not author:
+            msg = "no author found for package {0}".format(package.filename)
+            raise ValueError(msg)
+        return author
+
+    def license(self, package):
+        """Return the package license from its core metadata."""
+
+        metadata = self.metadata(package)
+        license = metadata.get("License", "").strip()
+        if not license or license == "UNKNOWN" or "\n" in license:
+            license = None
+            for item in metadata.get_all("Classifier") or []:
+                if item.startswith("License ::"):
+                    license = item.split("::")[-1].strip()
+                    break
+        if not license:
+            msg = "no license found for package {0}".format(package.filename)
+            raise ValueError(msg)
+        return license
+
+
+class PyPISource(Source):
+    """Package source based on the PyPI project pages."""
+
+    def __init__(self):
+        """Create a new instance with an empty cache of project pages."""
+
+        super(PyPISource, self).__init__()
+        self.pages = {}
 
-        nsuffixes = 1 + int(self.filename.endswith(".tar.gz"))
-        base = self.filename.rsplit(".", nsuffixes)[0]
-        return base.split("-")[0]
+    @staticmethod
+    def project_url(package):
+        """PyPI project url in string format (file download view)."""
 
-    @property
-    def version(self):
-        """Python package version in string format."""
+        urlpattern = "https://pypi.org/project/{0}/{1}/#files"
+        return urlpattern.format(package.name, package.version)
 
-        nsuffixes = 1 + int(self.filename.endswith(".tar.gz"))
-        base = self.filename.rsplit(".", nsuffixes)[0]
-        return base.split("-")[1]
+    def project_html(self, package):
+        """PyPI project HTML in string format (file download view)."""
 
-    @property
-    def author(self):
+        try:
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import urlopen
+
+        url = self.project_url(package)
+        if url in self.pages:
+            return self.pages[url]
+
+        # This is just a temporarily workaround but needs a real fix.
+        # pylint: disable=protected-access
+        import ssl
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+        conn = urlopen(url)
+        try:
+            self.pages[url] = conn.read().decode("utf-8")
+        finally:
+            conn.close()
+        self.account(package, len(self.pages[url]))
+        return self.pages[url]
+
+    def url(self, package):
+        """Python package remote url from the PyPI repository."""
+
+        import re
+
+        filename_regex = package.filename.replace(".", "\\.")
+        pattern = ".*<a href=\"(.*{0}.*)\">".format(filename_regex)
+
+        for htmlrow in self.project_html(package).splitlines():
+            match = re.match(pattern, htmlrow)
+            if match:
+                return match.group(1)
+        msg = "no url found for package {0}".format(package.filename)
+        raise ValueError(msg)
+
+    def author(self, package):
         """Package author as shown in PyPI."""
 
         import re
 
         pattern = ".*<p><strong>Author:</strong> <a href=\".*\">(.*)</a></p>"
-        for htmlrow in self.pypi_project_html.splitlines():
+        for htmlrow in self.project_html(package).splitlines():
             match = re.match(pattern, htmlrow)
             if match:
                 return match.group(1)
-        msg = "no author found for package {0}".format(self.filename)
+        msg = "no author found for package {0}".format(package.filename)
         raise ValueError(msg)
 
-    @property
-    def license(self):
+    def license(self, package):
         """Package license as shown in PyPI."""
 
         import re
 
         pattern = ".*<p><strong>License:</strong> (.*)</p>"
-        for htmlrow in self.pypi_project_html.splitlines():
+        for htmlrow in self.project_html(package).splitlines():
             match = re.match(pattern, htmlrow)
             if match:
-                license = match.group(1)
-                if re.match(r"MIT( License( \(UNKNOWN|MIT.*\)?))?", license):
-                    license = "MIT License (MIT)"
-                elif re.match(r"BSD( License( \(UNKNOWN|BSD.*\)?))?", license):
-                    license = "BSD License (BSD)"
-                return license
-        msg = "no license found for package {0}".format(self.filename)
+                return match.group(1)
+        msg = "no license found for package {0}".format(package.filename)
         raise ValueError(msg)
 
-    @property
-    def pypi_project_url(self):
-        """PyPI project url in string format (file download view)."""
 
-        urlpattern = "https://pypi.org/project/{0}/{1}/#files"
-        return urlpattern.format(self.name, self.version)
+class SimpleIndexSource(Source):
+    """Package source based on a PEP 503 simple repository index.
 
-    @cachedproperty
-    def pypi_project_html(self):
-        """PyPI project HTML in string format (file download view)."""
+    The HTTP connections are kept open and reused for every request
+    sent to the same host.
+    """
+
+    def __init__(self, root):
+        """Create a new instance from the simple index root url."""
+
+        super(SimpleIndexSource, self).__init__()
+        self.root = root.rstrip("/")
+        self.pages = {}
+        self.connections = {}
+
+    def request(self, url, redirects=5):
+        """Return the content of a url reusing the open connections.
 
+        At most ``redirects`` redirections are followed.
+        """
+
+        import socket
         try:
-            from urllib.request import urlopen
+            from http.client import HTTPConnection
+            from http.client import HTTPSConnection
+            from http.client import HTTPException
+            from urllib.parse import urljoin
+            from urllib.parse import urlsplit
         except ImportError:
-            from urllib2 import urlopen
+            from httplib import HTTPConnection
+            from httplib import HTTPSConnection
+            from httplib import HTTPException
+            from urlparse import urljoin
+            from urlparse import urlsplit
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path = "{0}?{1}".format(path, parts.query)
+
+        for attempt in (0, 1):
+            conn = self.connections.get(key)
+            if conn is None:
+                cls = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+                conn = self.connections[key] = cls(parts.netloc)
+            try:
+                conn.request("GET", path, headers={
+                    "User-Agent": "get-pip-pyopenssl/{0}".format(__version__),
+                })
+                response = conn.getresponse()
+                data = response.read()
+            except (socket.error, HTTPException):
+                # The server may have closed an idle connection, retry once.
+                conn.close()
+                del self.connections[key]
+                if attempt:
+                    raise
+                continue
+            if response.status in (301, 302, 303, 307, 308):
+                if redirects <= 0:
+                    raise ValueError("too many redirects for url {0}".format(url))
+                location = urljoin(url, response.getheader("Location"))
+                return self.request(location, redirects - 1)
+            if response.status != 200:
+                msg = "unexpected HTTP status {0} for url {1}"
+                raise ValueError(msg.format(response.status, url))
+            return data
+
+    def project_url(self, package):
+        """Simple index project url in string format."""
 
-        # This is just a temporarily workaround but needs a real fix.
-        # pylint: disable=protected-access
-        import ssl
-        ssl._create_default_https_context = ssl._create_unverified_context
+        import re
+
+        name = re.sub(r"[-_.]+", "-", package.name).lower()
+        return "{0}/{1}/".format(self.root, name)
 
-        conn = urlopen(self.pypi_project_url)
+    def project_html(self, package):
+        """Simple index project HTML in string format."""
+
+        url = self.project_url(package)
+        if url not in self.pages:
+            self.pages[url] = self.request(url).decode("utf-8")
+            self.account(package, len(self.pages[url]))
+        return self.pages[url]
+
+    def url(self, package):
+        """Python package remote url from the simple index."""
+
+        import re
         try:
-            html = conn.read().decode("utf-8")
-        finally:
-            conn.close()
-        return html
+            from urllib.parse import urljoin
+        except ImportError:
+            from urlparse import urljoin
+
+        pattern = r"<a\s[^>]*href=\"([^\"]+)\"[^>]*>\s*([^<]+?)\s*</a>"
+        html = self.project_html(package)
+        for match in re.finditer(pattern, html, re.IGNORECASE):
+            if match.group(2) == package.filename:
+                href = match.group(1).replace("&amp;", "&")
+                return urljoin(self.project_url(package), href)
+        msg = "no url found for package {0}".format(package.filename)
+        raise ValueError(msg)
+
+    def fetch(self, package):
+        """Return the content of a package checking its hash if given."""
+
+        import hashlib
+
+        url = self.url(package)
+        data = self.request(url.split("#", 1)[0])
+        if "#" in url:
+            algorithm, digest = url.split("#", 1)[1].split("=", 1)
+            if hashlib.new(algorithm, data).hexdigest() != digest:
+                msg = "hash mismatch for package {0}".format(package.filename)
+                raise ValueError(msg)
+        return data
+
+
+class DirectorySource(Source):
+    """Package source based on a local folder of wheels and sdists."""
+
+    def __init__(self, root):
+        """Create a new instance from the local folder path."""
+
+        super(DirectorySource, self).__init__()
+        self.root = root
+
+    @cachedproperty
+    def files(self):
+        """Mapping of package filenames to paths, indexed only once."""
+
+        import os
+
+        files = {}
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith((".whl", ".tar.gz", ".zip")):
+                    files.setdefault(name, os.path.join(root, name))
+        return files
+
+    def url(self, package):
+        """Python package path inside the local folder."""
+
+        try:
+            return self.files[package.filename]
+        except KeyError:
+            msg = "no file found for package {0}".format(package.filename)
+            raise ValueError(msg)
+
+    def fetch(self, package):
+        """Return the content of a package read from the local folder."""
+
+        import io
+
+        with io.open(self.url(package), "rb") as fd:
+            return fd.read()
+
+
+def get_source(spec):
+    """Return the package source described by a string specification.
+
+    The specification is either ``pypi`` (the PyPI project pages), the
+    url of a PEP 503 simple index or the path to a local folder.
+    """
+
+    import os
+    import re
+
+    if spec == "pypi":
+        return PyPISource()
+    if re.match("https?://.*", spec):
+        return SimpleIndexSource(spec)
+    if os.path.isdir(spec):
+        return DirectorySource(spec)
+    raise ValueError("invalid package source '{0}'".format(spec))
+
+
+class Package(object):
+    """Wrapper class for Python packages coming from a package source."""
+
+    def __init__(self, filename, exclude=(), source=None):
+        """Create a new instance from a Python package filename.
+
+        The optional ``exclude`` sequence contains package-specific
+        glob patterns of wheel members to drop when slimming the wheel.
+        If ``source`` is not given, the package is retrieved from PyPI.
+        """
+
+        self.filename = filename
+        self.exclude = tuple(exclude)
+        self.source = PyPISource() if source is None else source
+        self.data = None
 
     @property
-    def pypi_package_url(self):
-        """Python package remote url from the PyPI repository."""
+    def name(self):
+        """Python package name."""
+
+        nsuffixes = 1 + int(self.filename.endswith(".tar.gz"))
+        base = self.filename.rsplit(".", nsuffixes)[0]
+        return base.split("-")[0]
+
+    @property
+    def version(self):
+        """Python package version in string format."""
+
+        nsuffixes = 1 + int(self.filename.endswith(".tar.gz"))
+        base = self.filename.rsplit(".", nsuffixes)[0]
+        return base.split("-")[1]
+
+    @property
+    def author(self):
+        """Package author as provided by the package source."""
+
+        return self.source.author(self)
+
+    @property
+    def license(self):
+        """Package license as provided by the package source."""
 
         import re
 
-        filename_regex = self.filename.replace(".", "\\.")
-        pattern = ".*<a href=\"(.*{0}.*)\">".format(filename_regex)
+        license = self.source.license(self)
+        if re.match(r"MIT( License( \(UNKNOWN|MIT.*\)?))?", license):
+            license = "MIT License (MIT)"
+        elif re.match(r"BSD( License( \(UNKNOWN|BSD.*\)?))?", license):
+            license = "BSD License (BSD)"
+        return license
 
-        for htmlrow in self.pypi_project_html.splitlines():
-            match = re.match(pattern, htmlrow)
-            if match:
-                return match.group(1)
-        msg = "no url found for package {0}".format(self.filename)
-        raise ValueError(msg)
+    @property
+    def url(self):
+        """Python package location in the package source."""
+
+        return self.source.url(self)
 
     def download(self):
         """Get the Python package as a :class:`bytes` object."""
 
-        try:
-            from urllib.request import urlopen
-        except ImportError:
-            from urllib2 import urlopen
+        self.data = self.source.fetch(self)
+
+    def slim(self, exclude=()):
+        """Repack the wheel without the members matching the exclude rules.
+
+        The patterns in ``exclude`` are applied together with the
+        package-specific ones. Members inside the `.dist-info` folder
+        are always kept and the `RECORD` file is rewritten to list only
+        the remaining members. Return the number of bytes saved.
+        """
+
+        import io
+        import fnmatch
+        import zipfile
+
+        if self.data is None:
+            self.download()
+
+        patterns = tuple(exclude) + self.exclude
+        if not self.filename.endswith(".whl") or not patterns:
+            return 0
+
+        def is_excluded(member):
+            """Internal function to match a wheel member against rules."""
+            if member.split("/", 1)[0].endswith(".dist-info"):
+                return False
+            return any(fnmatch.fnmatch(member, item) for item in patterns)
 
-        conn = urlopen(self.pypi_package_url)
+        fd1 = zipfile.ZipFile(io.BytesIO(self.data), "r")
         try:
-            self.data = conn.read()
+            infos = fd1.infolist()
+            dropped = set(info.filename for info in infos
+                          if is_excluded(info.filename))
+            if not dropped:
+                return 0
+            stream = io.BytesIO()
+            fd2 = zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED)
+            try:
+                for info in infos:
+                    if info.filename in dropped:
+                        continue
+                    content = fd1.read(info.filename)
+                    if info.filename.endswith(".dist-info/RECORD"):
+                        content = self.slim_record(content, dropped)
+                    fd2.writestr(info, content)
+            finally:
+                fd2.close()
         finally:
-            conn.close()
+            fd1.close()
+
+        data = stream.getvalue()
+        saved = len(self.data) - len(data)
+        self.data = data
+        return saved
+
+    @staticmethod
+    def slim_record(content, dropped):
+        """Return a wheel `RECORD` content without the dropped members."""
+
+        lines = []
+        for line in content.decode("utf-8").splitlines():
+            member = line.rsplit(",", 2)[0].strip("\"")
+            if member not in dropped:
+                lines.append(line)
+        return "".join("{0}\n".format(line) for line in lines).encode("utf-8")
 
     def textify(self, indent=0):
         """Return the Python package data as plain encoded text."""
 
+        import hashlib
+
         if self.data is None:
             self.download()
 
@@ -217,6 +763,8 @@ class Package(object):
             "{indent}        \"{license}\",",
             "{indent}    \"filename\":",
             "{indent}        \"{filename}\",",
+            "{indent}    \"sha256\":",
+            "{indent}        \"{sha256}\",",
             "{indent}    \"filedata\": \"\"\"",
             "{filedata}",
             "{indent}    \"\"\",",
@@ -225,6 +773,7 @@ class Package(object):
                   author=self.author,
                   license=self.license,
                   filename=self.filename,
+                  sha256=hashlib.sha256(self.data).hexdigest(),
                   filedata=self.pkgencode(self.data),
                   indent=" " * indent)
 
@@ -249,25 +798,74 @@ class Package(object):
         return b64decode("".join(line.strip() for line in text.split("\n")))
 
 
+def prepare(package, exclude=None, timings=None):
+    """Download, slim and encode a package recording the phase timings.
+
+    The slimming stage is skipped if ``exclude`` is None. Return the
+    package as plain encoded text.
+    """
+
+    if timings is None:
+        timings = Timings()
+
+    # Locate the package (this may need to read a project page).
+    source = package.source
+    record = timings.start("metadata", package=package.filename)
+    record["url"] = package.url
+    timings.stop(record, source.metadata_size(package))
+
+    record = timings.start("download", package=package.filename)
+    package.download()
+    timings.stop(record, len(package.data))
+
+    # Resolve author and license (this may need to read the metadata).
+    size = source.metadata_size(package)
+    record = timings.start("metadata", package=package.filename)
+    record["author"] = package.author
+    record["license"] = package.license
+    timings.stop(record, source.metadata_size(package) - size)
+
+    if exclude is not None:
+        size = len(package.data)
+        record = timings.start("slim", package=package.filename)
+        saved = package.slim(exclude=exclude)
+        timings.stop(record, len(package.data))
+        print("  - Slimmed {0}: {1} -> {2} bytes ({3} saved)".format(
+            package.filename, size, size - saved, saved))
+
+    record = timings.start("encode", package=package.filename)
+    text = package.textify(indent=4)
+    timings.stop(record, len(text))
+    return text
+
+
+def render(path, semver, injection):
+    """Write a `get-pip-pyopenssl` script from its template."""
+
+    import io
+    import os.path
+
+    here = os.path.dirname(__file__)
+    template_file = os.path.join(here, "template-script.py")
+    with io.open(path, "wb") as fd1:
+        with io.open(template_file, "r", encoding="utf-8") as fd2:
+            for line2 in fd2:
+                if line2 == "#! /usr/bin/env python\n":
+                    line2 = "#! /usr/bin/env python{0}\n".format(semver)
+                if line2 == "__version__ = None\n":
+                    line2 = "__version__ = \"{0}\"\n".format(__version__)
+                if line2 == "PACKAGES = {}\n":
+                    line2 = "PACKAGES = {{\n\n{0}\n\n}}\n".format(injection)
+                fd1.write(line2.encode("utf-8"))
+
+
 def main():
     """Main script function."""
 
-    import io
     import re
     import os.path
     import argparse
 
-    valid_targets = {
-        ("Windows", "32bit"):
-            "win32",
-        ("Windows", "64bit"):
-            "win_amd64",
-        ("Linux", "32bit"):
-            "manylinux1_i686",
-        ("Linux", "64bit"):
-            "manylinux1_x86_64",
-    }
-
     # Define arguments.
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -286,13 +884,24 @@ def main():
         "--dest",
         type=str, help="Destination folder", required=False,
         default="./")
+    parser.add_argument(
+        "--no-slim",
+        action="store_true", help="Do not remove unneeded wheel members",
+        required=False, default=False)
+    parser.add_argument(
+        "--timings",
+        type=str, help="JSON file where to write the timing report",
+        required=False, default=None)
+    parser.add_argument(
+        "--source",
+        type=str, help="Package source ('pypi', simple index url or folder)",
+        required=False, default="pypi")
 
     # Parse arguments.
     args = parser.parse_args()
     version = re.match(r"(cp\d+)m?u?", args.abi).groups(1)[0]
     semver = ".".join(re.match(r"cp(\d)(\d+)", version).groups())
-    label = "-".join([version, args.abi,
-                      valid_targets[(args.target, args.arch)]])
+    label = get_label(args.target, args.arch, args.abi)
 
     # Do not allow 'mu' implementations for Windows.
     if args.target == "Windows" and args.abi.endswith("mu"):
@@ -304,7 +913,8 @@ def main():
         crypto_version = "2.0.3" if args.target == "Windows" else "2.1.1"
         packages = [
             # Essential packages (`pip`, `wheel` and `setuptools`).
-            Package("pip-9.0.3-py2.py3-none-any.whl"),
+            Package("pip-9.0.3-py2.py3-none-any.whl",
+                    exclude=["pip/_vendor/webencodings/tests.py"]),
             Package("argparse-1.4.0-py2.py3-none-any.whl"),
             Package("wheel-0.29.0-py2.py3-none-any.whl"),
             Package("setuptools-36.8.0-py2.py3-none-any.whl"),
@@ -326,7 +936,8 @@ def main():
     elif semver == "2.7":
         packages = [
             # Essential packages (`pip`, `wheel` and `setuptools`).
-            Package("pip-20.3.4-py2.py3-none-any.whl"),
+            Package("pip-20.3.4-py2.py3-none-any.whl",
+                    exclude=["pip/_vendor/webencodings/tests.py"]),
             Package("argparse-1.4.0-py2.py3-none-any.whl"),
             Package("wheel-0.36.2-py2.py3-none-any.whl"),
             Package("setuptools-44.1.1-py2.py3-none-any.whl"),
@@ -348,25 +959,29 @@ def main():
         msg = "unsupported Python ABI version '{0}' under {1} {2}"
         raise ValueError(msg.format(args.abi, args.target, args.arch))
 
+    timings = Timings()
+    source = get_source(args.source)
+    exclude = None
+    if not args.no_slim:
+        exclude = SLIM_EXCLUDE + SLIM_EXCLUDE_TARGET[args.target]
     pkgtext = []
     for pkg in packages:
-        pkgtext.append(pkg.textify(indent=4))
+        pkg.source = source
+        pkgtext.append(prepare(pkg, exclude=exclude, timings=timings))
     injection = "\n".join(pkgtext)
 
-    here = os.path.dirname(__file__)
-    template_file = os.path.join(here, "template-script.py")
     target_name = "get-pip-pyopenssl-{0}.py".format(label)
+    target_path = os.path.join(args.dest, target_name)
+    record = timings.start("render")
     makedirs(args.dest, exist_ok=True)
-    with io.open(os.path.join(args.dest, target_name), "wb") as fd1:
-        with io.open(template_file, "r", encoding="utf-8") as fd2:
-            for line2 in fd2:
-                if line2 == "#! /usr/bin/env python\n":
-                    line2 = "#! /usr/bin/env python{0}\n".format(semver)
-                if line2 == "__version__ = None\n":
-                    line2 = "__version__ = \"{0}\"\n".format(__version__)
-                if line2 == "PACKAGES = {}\n":
-                    line2 = "PACKAGES = {{\n\n{0}\n\n}}\n".format(injection)
-                fd1.write(line2.encode("utf-8"))
+    render(target_path, semver, injection)
+    timings.stop(record, os.path.getsize(target_path))
+
+    # Write out the timing report.
+    if args.timings:
+        timings.dump(args.timings, label=label, target=args.target,
+                     arch=args.arch, abi=args.abi)
+        print(timings.summary())
 
 
 if __name__ == "__main__":
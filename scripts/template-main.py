@@ -35,16 +35,37 @@ SNI support:
 __version__ = None
 
 
+def get_config_var(name):
+    """Return a build configuration variable of the Python installation."""
+
+    try:
+        import sysconfig
+    except ImportError:
+        # Python 2.6 does not provide the lightweight `sysconfig` module.
+        from distutils import sysconfig
+    return sysconfig.get_config_var(name)
+
+
+def get_platform():
+    """Return the raw platform string (e.g. 'linux-x86_64', 'win-amd64')."""
+
+    try:
+        import sysconfig
+    except ImportError:
+        # Python 2.6 does not provide the lightweight `sysconfig` module.
+        import distutils.util as sysconfig
+    return sysconfig.get_platform()
+
+
 def get_arch():
     """Return the platform name."""
 
-    import sys
-    import distutils.util
+    import struct
 
-    value = distutils.util.get_platform().replace("-", "_")
+    value = get_platform().replace("-", "_")
     if value.startswith("macosx"):
         raise NotImplementedError
-    if value == "linux_x86_64" and sys.maxsize == 2147483647:
+    if value == "linux_x86_64" and struct.calcsize("P") == 4:
         value = "linux_i686"
     return value.replace("linux", "manylinux1")
 
@@ -54,18 +75,17 @@ def get_abi():
 
     import sys
     import platform
-    from distutils import sysconfig
 
     # Get ABI flags.
-    abid = ("d" if sysconfig.get_config_var("WITH_PYDEBUG") == 1 or
+    abid = ("d" if get_config_var("WITH_PYDEBUG") == 1 or
             hasattr(sys, "gettotalrefcount")
             else "")
     abim = ("m" if sys.version_info < (3, 8) and
-            sysconfig.get_config_var("WITH_PYMALLOC") == 1 or
+            get_config_var("WITH_PYMALLOC") == 1 or
             platform.python_implementation() == "CPython"
             else "")
     abiu = ("u" if sys.version_info < (3, 3) and
-            sysconfig.get_config_var("Py_UNICODE_SIZE") == 4 or
+            get_config_var("Py_UNICODE_SIZE") == 4 or
             sys.maxunicode == 0x10FFFF
             else "")
 
@@ -76,20 +96,140 @@ def get_abi():
     return pyabi
 
 
+def save(conn, path, gzipped=False, chunksize=65536):
+    """Stream an open url connection into a local file and close it.
+
+    Gzip data is decompressed while streaming and a ``zlib.error`` is
+    raised if the stream is truncated, so that the file is not used.
+    """
+
+    import struct
+    import zlib
+
+    # Use a zlib decompressor that expects a gzip header and trailer.
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    crc, size, tail = 0, 0, b""
+    try:
+        with open(path, "wb") as fd:
+            while True:
+                chunk = conn.read(chunksize)
+                if not chunk:
+                    break
+                if decoder is not None:
+                    tail = (tail + chunk)[-8:]
+                    chunk = decoder.decompress(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                fd.write(chunk)
+            if decoder is not None:
+                chunk = decoder.flush()
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                fd.write(chunk)
+    finally:
+        conn.close()
+
+    if decoder is None:
+        return
+    if hasattr(decoder, "eof"):
+        complete = decoder.eof
+    else:
+        # Python < 3.3: compare the gzip trailer (CRC32 and size).
+        trailer = struct.pack("<II", crc & 0xFFFFFFFF, size & 0xFFFFFFFF)
+        complete = tail == trailer
+    if not complete:
+        raise zlib.error("truncated gzip stream")
+
+
+def fetch(url, path, chunksize=65536):
+    """Stream the contents of a remote url into a local file.
+
+    The precompressed ``.gz`` sibling of the url is requested first. If
+    it is not available or it is not valid gzip data, the plain url is
+    requested allowing a gzip transfer encoding. Compressed data is
+    decompressed while streaming.
+    """
+
+    import zlib
+
+    try:
+        from urllib.request import Request
+        from urllib.request import urlopen
+        from urllib.error import HTTPError
+    except ImportError:
+        from urllib2 import Request
+        from urllib2 import urlopen
+        from urllib2 import HTTPError
+
+    try:
+        save(urlopen("{0}.gz".format(url)), path, True, chunksize)
+        return
+    except HTTPError:
+        pass
+    except zlib.error:
+        # The server answered with something else (e.g. a soft 404 page)
+        # or the transfer was truncated.
+        pass
+
+    conn = urlopen(Request(url, headers={"Accept-Encoding": "gzip"}))
+    gzipped = conn.info().get("Content-Encoding", "") == "gzip"
+    save(conn, path, gzipped, chunksize)
+
+
+def run(path, args=(), inprocess=False):
+    """Run a `get-pip-pyopenssl` script and return its exit code."""
+
+    import sys
+    import subprocess
+
+    if not inprocess:
+        return subprocess.call([sys.executable, "-u", path] + list(args))
+
+    argv = sys.argv[:]
+    sys.argv[:] = [path] + list(args)
+    try:
+        try:
+            from runpy import run_path
+        except ImportError:
+            # Python 2.6 does not provide `runpy.run_path`.
+            with open(path, "rb") as fd:
+                code = compile(fd.read(), path, "exec")
+            exec(code, {"__name__": "__main__", "__file__": path})  # pylint: disable=exec-used
+        else:
+            run_path(path, run_name="__main__")
+    except SystemExit as err:
+        return err.code if isinstance(err.code, int) else int(bool(err.code))
+    finally:
+        sys.argv[:] = argv
+    return 0
+
+
 def main():
     """Main script call."""
 
     import os
     import re
     import sys
+    import errno
     import shutil
     import tempfile
-    import subprocess
+    import optparse  # pylint: disable=deprecated-module
 
-    try:
-        from urllib.request import urlopen
-    except ImportError:
-        from urllib2 import urlopen
+    # Define arguments (`argparse` is not available in Python 2.6).
+    parser = optparse.OptionParser(
+        usage="%prog [options] [-- script options]", version=__version__)
+    parser.add_option(
+        "--in-process",
+        action="store_true", dest="inprocess", default=False,
+        help="Run the downloaded script inside the current interpreter")
+    parser.add_option(
+        "--cache-dir",
+        type="string", dest="cachedir", default=None,
+        help="Folder where the downloaded script is kept for reuse "
+             "(one subfolder per release)")
+
+    # Parse arguments.
+    args, extra = parser.parse_args()
 
     arch = get_arch()
     pyabi = get_abi()
@@ -102,24 +242,46 @@ def main():
         # Script root is an URL.
         scriptpath = "/".join([scriptroot.strip("/"), "pip", version,
                                scriptname])
+        tmpdir = None
         try:
-            tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-pyopenssl-")
-            tmppath = os.path.join(tmpdir, scriptname)
-            conn = urlopen(scriptpath)
-            try:
-                with open(tmppath, "wb") as fd:
-                    fd.write(conn.read())
-            finally:
-                conn.close()
-            subprocess.call([sys.executable, "-u", tmppath])
+            if args.cachedir:
+                # Scripts from different releases share the same name.
+                cachedir = os.path.join(args.cachedir, str(__version__),
+                                        version)
+                try:
+                    os.makedirs(cachedir)
+                except OSError as err:
+                    # Another process may have created it concurrently.
+                    if err.errno != errno.EEXIST:
+                        raise
+            else:
+                tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-pyopenssl-")
+                cachedir = tmpdir
+            tmppath = os.path.join(cachedir, scriptname)
+            if not os.path.isfile(tmppath):
+                partpath = "{0}.part{1}".format(tmppath, os.getpid())
+                try:
+                    fetch(scriptpath, partpath)
+                    try:
+                        os.rename(partpath, tmppath)
+                    except OSError:
+                        # Under Windows, another process may have renamed
+                        # it first; the partial file is then discarded.
+                        if not os.path.isfile(tmppath):
+                            raise
+                finally:
+                    if os.path.isfile(partpath):
+                        os.remove(partpath)
+            retcode = run(tmppath, extra, inprocess=args.inprocess)
         finally:
             if tmpdir:
                 shutil.rmtree(tmpdir, ignore_errors=True)
     else:
         # Script root is a folder.
         scriptpath = os.path.join(scriptroot, "pip", version, scriptname)
-        subprocess.call([sys.executable, "-u", scriptpath])
+        retcode = run(scriptpath, extra, inprocess=args.inprocess)
+    return retcode
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -38,52 +38,154 @@ from __future__ import print_function
 __version__ = None
 
 
-def unpack(path, dest=None):
-    """Unpack a wheel file into a destination folder."""
+def pkgdecode(text):
+    """Return an in-memory package stream from a textified version."""
+
+    from base64 import b64decode
+    return b64decode("".join(line.strip() for line in text.split("\n")))
+
+
+def cache_dir():
+    """Return the default host-level cache folder for decoded packages."""
 
     import os
-    from zipfile import ZipFile
+    import tempfile
+
+    name = "get-pip-pyopenssl-cache"
+    if hasattr(os, "getuid"):
+        name = "{0}-{1}".format(name, os.getuid())
+    return os.path.join(tempfile.gettempdir(), name)
+
 
-    pkgname = os.path.basename(path).split("-")[0]
-    if dest is None:
-        dest = os.getcwd()
+def cache_prepare(path):
+    """Create a cache folder if needed and check that it is safe to use.
+
+    The folder is created readable and writable only by the current user.
+    An existing folder is refused if it is a symbolic link, if it belongs
+    to another user or if other users can write into it.
+    """
+
+    import os
+    import stat
 
-    archive = ZipFile(path, "r")
     try:
-        for file in archive.namelist():
-            if file.startswith("{0}/".format(pkgname)):
-                archive.extract(file, dest)
-    finally:
-        archive.close()
+        os.makedirs(path, 448)  # 0o700
+    except OSError:
+        if not os.path.isdir(path):
+            raise
 
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError("unsafe cache folder (not a folder): {0}".format(path))
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise RuntimeError("unsafe cache folder (not owned): {0}".format(path))
+    if os.name != "nt" and info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError("unsafe cache folder (writable): {0}".format(path))
+    return path
 
-def pkgdecode(text):
-    """Return an in-memory package stream from a textified version."""
 
-    from base64 import b64decode
-    return b64decode("".join(line.strip() for line in text.split("\n")))
+def read_token(path):
+    """Return the content of a marker file or None if it does not exist."""
 
+    import io
+    import os
 
-def pip_extract(pkgname, dest=None):
-    """Extract a textified package into a destination directory."""
+    if not os.path.isfile(path):
+        return None
+    with io.open(path, "r", encoding="utf-8") as fd:
+        return fd.read()
+
+
+def lock_acquire(path):
+    """Acquire an exclusive cross-process lock on a file and return it."""
+
+    fd = open(path, "a+b")
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        fd.seek(0)
+        while True:
+            try:
+                # `LK_LOCK` only retries for 10 seconds before giving up.
+                msvcrt.locking(fd.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except IOError:
+                continue
+    else:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+    return fd
+
+
+def lock_release(fd):
+    """Release a cross-process lock acquired with `lock_acquire`."""
+
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        fd.seek(0)
+        msvcrt.locking(fd.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+    fd.close()
+
+
+def pip_decode(pkgname, cachedir):
+    """Decode a textified package into a shared cache and return its path.
+
+    Decoded packages are stored under their sha256 digest and written
+    atomically, so concurrent processes can reuse the same files. Cached
+    files are checked against the digest and decoded again on mismatch.
+    """
 
     import io
     import os
-    import shutil
-    import tempfile
+    import errno
+    import hashlib
 
     pkg = PACKAGES[pkgname]
-    tmpdir = None
+    pkgdir = os.path.join(cachedir, pkg["sha256"])
+    pkgpath = os.path.join(pkgdir, pkg["filename"])
+    if os.path.isfile(pkgpath):
+        with io.open(pkgpath, "rb") as fd:
+            if hashlib.sha256(fd.read()).hexdigest() == pkg["sha256"]:
+                return pkgpath
+        os.remove(pkgpath)
+
+    pkgdata = pkgdecode(pkg["filedata"])
+    if hashlib.sha256(pkgdata).hexdigest() != pkg["sha256"]:
+        raise ValueError("corrupted payload for package {0}".format(pkgname))
     try:
-        tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-extract-")
-        pkgpath = os.path.join(tmpdir, pkg["filename"])
-        pkgdata = pkgdecode(pkg["filedata"])
-        with io.open(pkgpath, "wb") as fd:
-            fd.write(pkgdata)
-        unpack(pkgpath, dest=dest)
-    finally:
-        if tmpdir:
-            shutil.rmtree(tmpdir, ignore_errors=True)
+        os.makedirs(pkgdir, 448)  # 0o700
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    tmppath = "{0}.tmp{1}".format(pkgpath, os.getpid())
+    with io.open(tmppath, "wb") as fd:
+        fd.write(pkgdata)
+    try:
+        os.rename(tmppath, pkgpath)
+    except OSError:
+        # Under Windows, another process may have renamed it first.
+        os.remove(tmppath)
+        if not os.path.isfile(pkgpath):
+            raise
+    return pkgpath
+
+
+def pip_zipimport(pkgname, cachedir):
+    """Decode a textified package as a wheel and make it importable.
+
+    The wheel file is inserted directly in ``sys.path`` so that its
+    content is loaded through `zipimport` without being extracted.
+    """
+
+    import sys
+
+    pkgpath = pip_decode(pkgname, cachedir)
+    sys.path.insert(0, pkgpath)
+    return pkgpath
 
 
 def pip_install(pkgname, *args):
@@ -104,9 +206,11 @@ def pip_install(pkgname, *args):
         # pip main call for pip >= 10.
         if hasattr(pip, "_internal"):
             env = os.environ.copy()
-            env["PYTHONPATH"] = "{0}{1}{2}".format(
-                pip_parent_dir, ";" if os.name == "nt" else ":",
-                os.environ.get("PYTHONPATH", ""))
+            zippaths = [item for item in sys.path
+                        if item.endswith(".whl") and item != pip_parent_dir]
+            env["PYTHONPATH"] = os.pathsep.join(
+                [pip_parent_dir] + zippaths +
+                [os.environ.get("PYTHONPATH", "")])
             witems = [SNIMissingWarning, InsecurePlatformWarning, SubjectAltNameWarning]
             wflags = ["-W ignore::{0}.{1}".format(x.__module__, x.__name__)
                       for x in witems]
@@ -125,26 +229,10 @@ def pip_install(pkgname, *args):
         raise RuntimeError("pip failed with exit code {0}".format(retcode))
 
 
-def pip_autoinstall(pkgname, *args):
+def pip_autoinstall(pkgname, cachedir, *args):
     """Install a textified package."""
 
-    import io
-    import os
-    import shutil
-    import tempfile
-
-    pkg = PACKAGES[pkgname]
-    tmpdir = None
-    try:
-        tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-autoinstall-")
-        pkgpath = os.path.join(tmpdir, pkg["filename"])
-        pkgdata = pkgdecode(pkg["filedata"])
-        with io.open(pkgpath, "wb") as fd:
-            fd.write(pkgdata)
-        pip_install(pkgpath, *args)
-    finally:
-        if tmpdir:
-            shutil.rmtree(tmpdir, ignore_errors=True)
+    pip_install(pip_decode(pkgname, cachedir), *args)
 
 
 def pip_autopatch():
@@ -200,8 +288,127 @@ def pip_autopatch():
         fd.writelines([line.encode("utf-8") for line in lines])
 
 
-def main():
-    """Main script call."""
+def pip_wheelhouse(dest, cachedir):
+    """Copy every textified package into a local wheelhouse folder.
+
+    Every package is copied into a temporary file that is then renamed,
+    so other processes never see a partially written package.
+    """
+
+    import os
+    import errno
+    import shutil
+
+    try:
+        os.makedirs(dest)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    for pkgname, pkg in PACKAGES.items():
+        pkgpath = os.path.join(dest, pkg["filename"])
+        if os.path.isfile(pkgpath):
+            continue
+        tmppath = "{0}.tmp{1}".format(pkgpath, os.getpid())
+        shutil.copyfile(pip_decode(pkgname, cachedir), tmppath)
+        try:
+            os.rename(tmppath, pkgpath)
+        except OSError:
+            # Under Windows, another process may have renamed it first.
+            os.remove(tmppath)
+            if not os.path.isfile(pkgpath):
+                raise
+
+
+def pip_config_find(lines, section):
+    """Return the header, option and end lines of `find-links` in a section."""
+
+    import re
+
+    current = None
+    header = option = end = None
+    for i, line in enumerate(lines):
+        match = re.match(r"\s*\[(.*)\]\s*$", line)
+        if match:
+            current = match.group(1).strip()
+            if current == section and header is None:
+                header = i
+            continue
+        if current != section:
+            continue
+        if re.match(r"(find[-_]links)\s*[=:]", line):
+            option = end = i
+        elif end is not None and end == i - 1 and line[:1] in (" ", "\t"):
+            # Continuation line of a multi-line value.
+            end = i
+    return header, option, end
+
+
+def pip_config(findlinks):
+    """Add a folder to the `find-links` option of the user `pip` config.
+
+    The option is always set in the `global` section. Because a command
+    section overrides `global`, the folder is also appended to the option
+    when the `install`, `download` or `wheel` sections already define it.
+    The rest of the file is kept untouched. Because `pip` splits the option
+    value on whitespace, folders containing whitespace are refused.
+    """
+
+    import io
+    import os
+    import re
+    import errno
+
+    if re.search(r"\s", findlinks):
+        msg = "find-links folder cannot contain whitespace: {0}"
+        raise ValueError(msg.format(findlinks))
+
+    # Locate the user config file, which is shared by all environments.
+    if os.name == "nt":
+        confdir = os.path.join(os.environ["APPDATA"], "pip")
+        confpath = os.path.join(confdir, "pip.ini")
+    else:
+        confdir = os.path.join(os.environ.get("XDG_CONFIG_HOME") or
+                               os.path.expanduser("~/.config"), "pip")
+        confpath = os.path.join(confdir, "pip.conf")
+    try:
+        os.makedirs(confdir)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    lines = []
+    if os.path.isfile(confpath):
+        with io.open(confpath, "r", encoding="utf-8") as fd:
+            lines = fd.read().splitlines()
+
+    # Add the folder to every relevant section unless it is already listed.
+    changed = False
+    for section in ("global", "install", "download", "wheel"):
+        header, option, end = pip_config_find(lines, section)
+        if option is not None:
+            value = " ".join(lines[option:end + 1])
+            value = re.split(r"[=:]", value, 1)[1]
+            if findlinks in value.split():
+                continue
+            lines.insert(end + 1, "    {0}".format(findlinks))
+        elif section != "global":
+            continue
+        elif header is not None:
+            lines.insert(header + 1, "find-links = {0}".format(findlinks))
+        else:
+            if lines and lines[-1].strip():
+                lines.append("")
+            lines.extend(["[global]", "find-links = {0}".format(findlinks)])
+        changed = True
+
+    if changed:
+        with io.open(confpath, "wb") as fd:
+            fd.writelines([(line + "\n").encode("utf-8") for line in lines])
+    return confpath
+
+
+def pip_bootstrap(cachedir):
+    """Install `pip` and its dependencies and make it use `pyOpenSSL`."""
 
     import os
     import sys
@@ -218,42 +425,41 @@ def main():
         tmpdir = tempfile.mkdtemp(prefix="tmp-get-pip-")
         os.chdir(tmpdir)
 
-        # Unpack `pip` and `wheel` temporarily.
+        # Make `pip` and `wheel` importable from their wheels temporarily.
+        zippaths = {}
         for pkg in ("pip", "wheel"):
-            pip_extract(pkg)
-        sys.path.insert(0, tmpdir)
+            zippaths[pkg] = pip_zipimport(pkg, cachedir)
 
         # Install `pip`, `wheel` and `setuptools`.
         for pkg in ("pip", "argparse", "wheel", "setuptools"):
-            pip_autoinstall(pkg, *force_args)
+            pip_autoinstall(pkg, cachedir, *force_args)
 
-        # Delete temporary `pip` and `wheel` and reload the installed ones.
-        sys.path.pop(0)
+        # Drop temporary `pip` and `wheel` and reload the installed ones.
         for pkg in ("pip", "wheel"):
-            shutil.rmtree(pkg, ignore_errors=True)
+            sys.path.remove(zippaths[pkg])
+            sys.path_importer_cache.pop(zippaths[pkg], None)
             imp.reload(imp.load_module(pkg, *imp.find_module(pkg)))
 
         # Install `cffi` and its dependencies.
         for pkg in ("pycparser", "cffi"):
-            pip_autoinstall(pkg)
+            pip_autoinstall(pkg, cachedir)
 
         # Install `enum34` and its dependencies.
         for pkg in ("ordereddict", "enum34"):
             if pkg in PACKAGES:
-                pip_autoinstall(pkg, *force_args)
+                pip_autoinstall(pkg, cachedir, *force_args)
 
         # Install `cryptography` dependencies.
         for pkg in ("six", "asn1crypto", "idna", "ipaddress"):
-            pip_autoinstall(pkg)
+            pip_autoinstall(pkg, cachedir)
 
         # Install `cryptography` and `pyOpenSSL`.
         for pkg in ("cryptography", "pyOpenSSL"):
-            pip_autoinstall(pkg)
+            pip_autoinstall(pkg, cachedir)
 
         # Reload `pip` again and patch it.
         imp.reload(imp.load_module("pip", *imp.find_module("pip")))
         pip_autopatch()
-        print("Successfully patched pip")
 
     finally:
 
@@ -262,6 +468,78 @@ def main():
         os.chdir(curdir)
 
 
+def main():
+    """Main script call."""
+
+    import io
+    import os
+    import sys
+    import hashlib
+    import binascii
+    import optparse  # pylint: disable=deprecated-module
+
+    # Define arguments (`argparse` is not available in Python 2.6).
+    parser = optparse.OptionParser(version=__version__)
+    parser.add_option(
+        "--wheelhouse",
+        type="string", dest="wheelhouse", default=None,
+        help="Folder where to keep the bundled packages for later "
+             "installs (it is added to 'find-links' in the pip config); "
+             "bundled wheels are slimmed, so their hashes differ from "
+             "PyPI ones and they do not suit '--require-hashes' installs")
+    parser.add_option(
+        "--cache-dir",
+        type="string", dest="cachedir", default=None,
+        help="Folder shared between processes where to keep the decoded "
+             "packages (defaults to a folder in the temporary directory)")
+
+    # Parse arguments.
+    args = parser.parse_args()[0]
+    if args.wheelhouse and len(args.wheelhouse.split()) != 1:
+        parser.error("--wheelhouse folder cannot contain whitespace")
+
+    # Locate the shared cache and the install lock of this environment.
+    cachedir = cache_prepare(os.path.abspath(args.cachedir or cache_dir()))
+    prefix = sys.prefix
+    if not isinstance(prefix, bytes):
+        prefix = prefix.encode("utf-8")
+    envkey = hashlib.sha256(prefix).hexdigest()[:16]
+    lockpath = os.path.join(cachedir, "install-{0}.lock".format(envkey))
+    donepath = os.path.join(cachedir, "install-{0}.done".format(envkey))
+
+    # Install unless a concurrent process did it while waiting for the lock,
+    # which is detected by a change of the token stored in the marker file.
+    token = read_token(donepath)
+    lockfd = lock_acquire(lockpath)
+    try:
+        if read_token(donepath) != token:
+            print("Successfully patched pip (by a concurrent process)")
+        else:
+            pip_bootstrap(cachedir)
+            with io.open(donepath, "wb") as fd:
+                fd.write("{0} {1} {2}\n".format(
+                    __version__, os.getpid(),
+                    binascii.hexlify(os.urandom(16)).decode("ascii"))
+                    .encode("utf-8"))
+            print("Successfully patched pip")
+    finally:
+        lock_release(lockfd)
+
+    # Seed the wheelhouse with the bundled packages. The user `pip` config
+    # is shared by every environment, so use a lock in the per-user cache.
+    if args.wheelhouse:
+        wheelhouse = os.path.abspath(args.wheelhouse)
+        userdir = cache_prepare(cache_dir())
+        lockfd = lock_acquire(os.path.join(userdir, "wheelhouse.lock"))
+        try:
+            pip_wheelhouse(wheelhouse, cachedir)
+            confpath = pip_config(wheelhouse)
+        finally:
+            lock_release(lockfd)
+        print("Successfully seeded wheelhouse {0} ({1})".format(
+            wheelhouse, confpath))
+
+
 PACKAGES = {}
 
 